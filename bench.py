@@ -0,0 +1,190 @@
+"""
+Benchmarks
+
+Run with `python3 bench.py <name>`, or with no arguments to run all of them.
+Each benchmark prints one line per configuration it measures.
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import part2
+import part3
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+US = [1, 5, 10, 20, 50, 100]
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+# pure-Python vs. NumPy engine for get_avg
+def bench_engines(sizes=(10_000, 100_000, 1_000_000)):
+    part3.get_avg(US, 1, engine="numpy")  # don't count the NumPy import
+    for N in sizes:
+        expected, t_python = timed(part3.get_avg, US, N)
+        result, t_numpy = timed(part3.get_avg, US, N, engine="numpy")
+        assert result == expected
+        print(f"engines N={N}: python {t_python:.3f}s; numpy {t_numpy:.3f}s; "
+              f"speedup {t_python / t_numpy:.1f}x")
+
+def peak_memory(f, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        result = f(*args, **kwargs)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# peak memory of the full table vs. the rolling ring buffer
+def bench_rolling(sizes=(10_000, 100_000)):
+    for N in sizes:
+        expected, m_python = peak_memory(part3.get_avg, US, N)
+        result, m_rolling = peak_memory(part3.get_avg, US, N, engine="rolling")
+        assert result == expected
+        print(f"rolling N={N}: python peak {m_python / 1024:.0f} KiB; "
+              f"rolling peak {m_rolling / 1024:.1f} KiB")
+
+# one 2-D pass over many sets vs. a get_avg/get_score loop
+def bench_batch(sizes=(100, 1000, 5000), N=part3.DEFAULT_N):
+    rng = random.Random(0)
+    part3.score_batch([US], 1)  # don't count the NumPy import
+    for B in sizes:
+        denom_sets = [[1] + rng.sample(range(2, N + 1), 4) for _ in range(B)]
+        expected, t_loop = timed(lambda: [
+            part3.get_score(part3.get_avg(ds, N), len(ds)) for ds in denom_sets
+        ])
+        (_, scores), t_batch = timed(part3.score_batch, denom_sets, N)
+        assert scores.tolist() == expected
+        print(f"batch B={B}, N={N}: loop {t_loop:.3f}s; batch {t_batch:.3f}s; "
+              f"speedup {t_loop / t_batch:.1f}x")
+
+# whole average curve in one pass vs. get_avg for each N
+def bench_curve(sizes=(500, 2000)):
+    part3.avg_curve(US, 1)  # don't count the NumPy import
+    for N_max in sizes:
+        expected, t_loop = timed(lambda: [part3.get_avg(US, N) for N in range(N_max + 1)])
+        curve, t_curve = timed(part3.avg_curve, US, N_max)
+        assert curve.tolist() == expected
+        print(f"curve N_max={N_max}: get_avg per N {t_loop:.3f}s; "
+              f"avg_curve {t_curve:.4f}s; speedup {t_loop / t_curve:.0f}x")
+
+# rows per second through dump_users and load_users, via a file on disk
+def bench_csv(sizes=(100_000, 1_000_000)):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.csv")
+        for rows in sizes:
+            users = (part2.User(f"Doe, Jane {i}", i % 100) for i in range(rows))
+            with open(path, "w", newline="") as f:
+                _, t_dump = timed(part2.dump_users, users, f)
+            with open(path, newline="") as f:
+                count, t_load = timed(lambda: sum(1 for _ in part2.load_users(f)))
+            assert count == rows
+            table, t_parallel = timed(part2.load_users_parallel, path)
+            assert len(table) == rows
+            print(f"csv rows={rows}: dump {rows / t_dump:,.0f} rows/s; "
+                  f"load {rows / t_load:,.0f} rows/s; "
+                  f"parallel load ({os.cpu_count()} cpus) {rows / t_parallel:,.0f} rows/s")
+
+# recommend_friends on a random graph, with a memory budget small enough to
+# need many chunks vs. one big enough for a single one
+def bench_recommend(sizes=(10_000, 100_000), friends=20):
+    rng = random.Random(0)
+    for n in sizes:
+        users = [part2.User(str(i), 0, [str(rng.randrange(n)) for _ in range(friends)])
+                 for i in range(n)]
+        for budget in (1 << 20, 1 << 28):
+            (result, peak), elapsed = timed(peak_memory, lambda: sum(
+                len(candidates) for _, candidates in part2.recommend_friends(users, 10, budget)))
+            print(f"recommend users={n}, budget={budget >> 20} MiB: {elapsed:.2f}s; "
+                  f"{n / elapsed:,.0f} users/s; peak {peak / 2**20:.0f} MiB; "
+                  f"{result:,} recommendations")
+
+# pairs per second through add_friends, from a generator of random pairs
+def bench_add_friends(sizes=(1_000_000, 10_000_000), users=100_000):
+    for edges in sizes:
+        for symmetric in (False, True):
+            group = [part2.User(str(i), 0) for i in range(users)]
+            rng = random.Random(0)
+            names = [user.name for user in group]
+            stream = ((names[rng.randrange(users)], names[rng.randrange(users)])
+                      for _ in range(edges))
+            added, elapsed = timed(part2.add_friends, group, stream, symmetric)
+            print(f"add_friends edges={edges:,}, symmetric={symmetric}: "
+                  f"{edges / elapsed:,.0f} pairs/s; {added:,} added")
+
+# users per second from fetch_users against a local server that takes
+# latency seconds to answer each request
+def bench_fetch(users=2000, latency=0.01, concurrencies=(1, 8, 64, 256)):
+    import asyncio
+    responses = {str(i): f"user {i},{i},user {i + 1}" for i in range(users)}
+
+    async def fetch(concurrency):
+        async with part2.StandInUserServer(responses, latency) as server:
+            count = 0
+            async for _, user in part2.fetch_users(responses, server.host, server.port,
+                                                   concurrency=concurrency):
+                assert isinstance(user, part2.User)
+                count += 1
+            return count
+
+    for concurrency in concurrencies:
+        count, elapsed = timed(asyncio.run, fetch(concurrency))
+        assert count == users
+        print(f"fetch users={users}, latency={latency * 1000:.0f}ms, "
+              f"concurrency={concurrency}: {users / elapsed:,.0f} users/s")
+
+# cold start of the command line and of importing the parts as libraries,
+# which shouldn't load pytest or Hypothesis
+STARTUP_TARGET = 0.1
+
+def bench_startup(runs=7):
+    def best_of(args):
+        best = float('inf')
+        for _ in range(runs):
+            _, elapsed = timed(subprocess.run, [sys.executable, *args], check=True,
+                               stdout=subprocess.DEVNULL, cwd=HERE)
+            best = min(best, elapsed)
+        return best
+
+    bare = best_of(['-c', 'pass'])
+    for name, args in [
+        ("cli", ['part3.py', *map(str, US)]),
+        ("import", ['-c', 'import part1, part2, part3']),
+    ]:
+        elapsed = best_of(args)
+        print(f"startup {name}: {elapsed:.3f}s (bare interpreter {bare:.3f}s; "
+              f"target {STARTUP_TARGET}s)")
+        assert elapsed < STARTUP_TARGET, f"{name} startup over {STARTUP_TARGET}s"
+
+BENCHMARKS = {
+    "add_friends": bench_add_friends,
+    "batch": bench_batch,
+    "csv": bench_csv,
+    "curve": bench_curve,
+    "engines": bench_engines,
+    "fetch": bench_fetch,
+    "recommend": bench_recommend,
+    "rolling": bench_rolling,
+    "startup": bench_startup,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'names', nargs='*',
+        help=f'benchmarks to run, from {sorted(BENCHMARKS)} (default: all)'
+    )
+    names = parser.parse_args().names or sorted(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,20 @@
+"""
+Optional NumPy
+
+NumPy is only needed by part3.py's 'numpy' engine and a few of part2.py's
+bulk operations, and it takes around 100 ms to import, so neither part
+imports it at the top. They ask for it here when they need it:
+
+    from numpydeps import numpy_for
+
+    np = numpy_for("friend recommendations")
+
+which, if NumPy isn't installed, raises an ImportError naming what needed it.
+"""
+
+def numpy_for(feature):
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(f"{feature} requires NumPy (pip install numpy)") from None
+    return numpy
@@ -2,9 +2,8 @@
 Part 1: Mini exercises
 """
 
-from hypothesis import given, assume
-from hypothesis import strategies as st
-import pytest
+# pytest and Hypothesis are only loaded when testing, see testdeps.py
+from testdeps import pytest, given, assume, st
 
 z = st.integers(min_value=-1000, max_value=1000)
 
@@ -284,7 +283,7 @@ Remember to remove @pytest.mark.skip(reason="Unimplemented")
 once you have implemented each test.
 """
 
-from hypothesis import settings
+from testdeps import settings
 
 @given(st.integers(min_value=-42, max_value=142))
 @settings(max_examples=500)
@@ -2,9 +2,18 @@
 Part 2: Case study
 """
 
-from hypothesis import given
-from hypothesis import strategies as st
-import pytest
+# pytest and Hypothesis are only loaded when testing, see testdeps.py
+from testdeps import pytest, given, st
+
+import hashlib
+import mmap
+import os
+import struct
+import time
+from array import array
+from itertools import chain
+
+from numpydeps import numpy_for
 
 z = st.integers()
 t = st.text()
@@ -25,6 +34,9 @@ The other two methods are for convenience:
 """
 
 class User:
+    # no per-instance __dict__, which matters with millions of users
+    __slots__ = ("name", "age", "friends")
+
     def __init__(self, name, age, friends=None):
         self.name = name
         self.age = age
@@ -349,3 +361,912 @@ Answer in words only. Hint: Python is a highly dynamic language!
 Yes, we can use a wrapper around the function that keeps track of the state over multiple calls of update_age_with.
 ===== END OF Q17 ANSWER =====
 """
+
+"""
+Columnar storage
+
+For millions of users, UserTable stores them column by column instead of
+as objects: every distinct name (of a user or a friend) once, in one
+UTF-8 buffer with offsets, and each user as an index into those names,
+an age in an array('q'), and a range of friend name indices.
+Indexing a table gives a UserRow, a view of one user that reads its
+fields from the table, and prints and compares like a User. Views are
+read-only: to change a user (with add_friend, say), make a User out of
+their name, age and friends.
+"""
+
+class UserTable:
+    def __init__(self, users=()):
+        # name i is strings[string_offsets[i]:string_offsets[i + 1]]
+        self.strings = bytearray()
+        self.string_offsets = array('q', [0])
+        self.string_ids = {}
+        # user i is named name_ids[i] (or name i if name_ids is None), is
+        # ages[i] years old, and has friends
+        # friend_ids[friend_offsets[i]:friend_offsets[i + 1]]
+        self.name_ids = array('q')
+        self.ages = array('q')
+        self.friend_offsets = array('q', [0])
+        self.friend_ids = array('q')
+        self.extend(users)
+
+    # a table of users without friends, from their names (UTF-8, one after
+    # another, name i ending at string_offsets[i]) and ages
+    @classmethod
+    def from_columns(cls, strings, string_offsets, ages):
+        table = cls()
+        table.strings = bytearray(strings)
+        table.string_offsets.extend(string_offsets)
+        table.ages = array('q', ages)
+        # user i is named name i until a user is appended
+        table.name_ids = None
+        table.friend_offsets = array('q', bytes(8 * (len(table.ages) + 1)))
+        # built on the first call to intern
+        table.string_ids = None
+        return table
+
+    def __repr__(self):
+        return f"UserTable(users={len(self)}, names={len(self.string_offsets) - 1})"
+
+    def __len__(self):
+        return len(self.ages)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("user index out of range")
+        return UserRow(self, i)
+
+    def __iter__(self):
+        return (UserRow(self, i) for i in range(len(self)))
+
+    def intern(self, name):
+        if self.string_ids is None:
+            self.string_ids = {
+                self.string(i): i for i in range(len(self.string_offsets) - 1)
+            }
+        name_id = self.string_ids.get(name)
+        if name_id is None:
+            name_id = self.string_ids[name] = len(self.string_offsets) - 1
+            self.strings += name.encode("utf-8", "surrogatepass")
+            self.string_offsets.append(len(self.strings))
+        return name_id
+
+    def name_id(self, row):
+        return row if self.name_ids is None else self.name_ids[row]
+
+    def string(self, name_id):
+        start, end = self.string_offsets[name_id], self.string_offsets[name_id + 1]
+        return self.strings[start:end].decode("utf-8", "surrogatepass")
+
+    def append(self, user):
+        if self.name_ids is None:
+            self.name_ids = array('q', range(len(self.ages)))
+        self.ages.append(user.age)
+        self.name_ids.append(self.intern(user.name))
+        self.friend_ids.extend(self.intern(friend) for friend in user.friends)
+        self.friend_offsets.append(len(self.friend_ids))
+
+    def extend(self, users):
+        for user in users:
+            self.append(user)
+
+# not a subclass of User, which would give every view User's slots too
+class UserRow:
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    __repr__ = User.__repr__
+    __eq__ = User.__eq__
+
+    @property
+    def name(self):
+        return self.table.string(self.table.name_id(self.row))
+
+    @property
+    def age(self):
+        return self.table.ages[self.row]
+
+    @property
+    def friends(self):
+        table = self.table
+        start, end = table.friend_offsets[self.row], table.friend_offsets[self.row + 1]
+        return [table.string(i) for i in table.friend_ids[start:end]]
+
+"""
+Bulk CSV
+
+dump_users and load_users move whole user bases to and from files with
+to_csv and from_csv, one name,age line per user (so, like from_csv, the
+last comma on a line ends the name). Lines go out and come in chunk_size
+characters at a time, and load_users is a generator, so neither holds the
+whole file in memory. Names can't contain line breaks.
+"""
+
+# writes users (any iterable) to file, returns how many were written
+def dump_users(users, file, chunk_size=1 << 20):
+    count = 0
+    lines = []
+    size = 0
+    for user in users:
+        if "\n" in user.name or "\r" in user.name:
+            raise ValueError(f"can't write a name with a line break: {user.name!r}")
+        line = to_csv(user)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= chunk_size:
+            file.write("\n".join(lines) + "\n")
+            count += len(lines)
+            lines = []
+            size = 0
+    if lines:
+        file.write("\n".join(lines) + "\n")
+        count += len(lines)
+    return count
+
+# yields the users in file, reading chunk_size characters at a time
+# (open files with newline="" so that only "\n" ends a line)
+def load_users(file, chunk_size=1 << 20):
+    rest = ""
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        lines = (rest + chunk).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield from_csv(line)
+    if rest:
+        yield from_csv(rest)
+
+"""
+Parallel CSV loading
+
+load_users_parallel reads a name,age file like load_users, but on every
+core: the file is memory-mapped and cut into pieces of about chunk_bytes
+at line breaks, and a pool of processes parses the pieces (with the same
+last-comma rule as from_csv). Each piece comes back as three flat buffers
+(names, where each name ends, ages) instead of as User objects, and they
+are put together into a UserTable. The file must be UTF-8.
+Putting the pieces together is bulk copies, apart from shifting each
+piece's name offsets by where its names start, which is one NumPy
+addition per piece (or, without NumPy, a Python loop over the rows).
+"""
+
+# (names, name end offsets, ages) for the lines in bytes start..end of path
+def _parse_csv_chunk(task):
+    path, start, end = task
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+    if data.endswith(b"\n"):
+        data = data[:-1]
+
+    names = bytearray()
+    offsets = array('q')
+    ages = array('q')
+    if data:
+        for line in data.split(b"\n"):
+            name, comma, age = line.rpartition(b",")
+            if not comma:
+                raise ValueError(f"no comma in line {line!r}")
+            names += name
+            offsets.append(len(names))
+            ages.append(int(age))
+    return bytes(names), offsets.tobytes(), ages.tobytes()
+
+def load_users_parallel(path, workers=None, chunk_bytes=1 << 26):
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return UserTable()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            tasks = []
+            start = 0
+            while start < size:
+                end = mm.find(b"\n", min(start + chunk_bytes, size) - 1)
+                end = size if end < 0 else end + 1
+                tasks.append((path, start, end))
+                start = end
+
+    if workers == 1:
+        pieces = list(map(_parse_csv_chunk, tasks))
+    else:
+        # imported here, since it's slow to import and only this needs it
+        import multiprocessing
+        with multiprocessing.Pool(workers) as pool:
+            pieces = pool.map(_parse_csv_chunk, tasks)
+
+    try:
+        np = numpy_for("loading users in parallel")
+    except ImportError:
+        np = None
+    strings = bytearray()
+    string_offsets = array('q')
+    ages = array('q')
+    for names, offsets, piece_ages in pieces:
+        base = len(strings)
+        strings += names
+        if np is not None:
+            string_offsets.frombytes((np.frombuffer(offsets, dtype=np.int64) + base).tobytes())
+        else:
+            string_offsets.extend(base + o for o in array('q', offsets))
+        ages.frombytes(piece_ages)
+    return UserTable.from_columns(strings, string_offsets, ages)
+
+"""
+Binary records
+
+A lossless (friends included) alternative to CSV.
+Each user is, little-endian:
+
+    name length (4 bytes), name (UTF-8)
+    age (8 bytes, signed)
+    number of friends (4 bytes)
+    for each friend: name length (4 bytes), name (UTF-8)
+
+Decoding works on a memoryview of the input, so names are decoded straight
+out of the buffer without copying slices of it first.
+"""
+
+U32 = struct.Struct("<I")
+I64 = struct.Struct("<q")
+
+def _encode_str(s, out):
+    data = s.encode("utf-8", "surrogatepass")
+    out += U32.pack(len(data))
+    out += data
+
+# appends the record for user to out (a bytearray), and returns out
+def encode_user(user, out=None):
+    if out is None:
+        out = bytearray()
+    _encode_str(user.name, out)
+    try:
+        out += I64.pack(user.age)
+    except struct.error:
+        raise OverflowError(f"age {user.age} doesn't fit in 8 bytes") from None
+    out += U32.pack(len(user.friends))
+    for friend in user.friends:
+        _encode_str(friend, out)
+    return out
+
+def _decode_str(view, offset):
+    (size,) = U32.unpack_from(view, offset)
+    offset += U32.size
+    if offset + size > len(view):
+        raise ValueError("truncated user record")
+    return str(view[offset:offset + size], "utf-8", "surrogatepass"), offset + size
+
+# (user, offset just past its record) for the record at offset in buf
+def decode_user(buf, offset=0):
+    view = memoryview(buf)
+    try:
+        name, offset = _decode_str(view, offset)
+        (age,) = I64.unpack_from(view, offset)
+        (count,) = U32.unpack_from(view, offset + I64.size)
+        offset += I64.size + U32.size
+        friends = []
+        for _ in range(count):
+            friend, offset = _decode_str(view, offset)
+            friends.append(friend)
+    except struct.error:
+        raise ValueError("truncated user record") from None
+    return User(name, age, friends), offset
+
+# every user in buf, a sequence of records
+def decode_users(buf):
+    view = memoryview(buf)
+    offset = 0
+    while offset < len(view):
+        user, offset = decode_user(view, offset)
+        yield user
+
+"""
+User store
+
+A file of users (binary records, as above) with an on-disk hash index from
+name to record, so looking up one user by name reads one bucket and its
+chain instead of the whole file. Both files are memory-mapped.
+
+The index (path + ".idx") is a fixed number of buckets, each holding the
+offset of the latest record whose name hashes there (0 if none). Every
+record starts with the offset of the previous record in its bucket, so
+appending a user writes its record at the end of the data file and
+updates one bucket, without touching the rest of the index.
+Looking up a name that was appended more than once gives the latest user.
+The index never grows, and records are never removed from their chains
+(appending a name again leaves the old record behind the new one), so a
+lookup reads about n / n_buckets records for n appends. create makes a
+bucket for each of expected_users appends, unless given n_buckets.
+"""
+
+STORE_MAGIC = b"USERDAT\0"
+INDEX_MAGIC = b"USERIDX\0"
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct("<8sH")
+INDEX_HEADER = struct.Struct("<8sHq")
+# where the records and the buckets start, after their headers
+STORE_START = 16
+INDEX_START = 24
+
+def name_hash(name):
+    digest = hashlib.blake2b(name.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+class UserStore:
+    @classmethod
+    def create(cls, path, expected_users=1 << 16, n_buckets=None):
+        if n_buckets is None:
+            n_buckets = max(1, expected_users)
+        if n_buckets < 1:
+            raise ValueError(f"n_buckets must be positive, got {n_buckets}")
+        with open(path, "wb") as f:
+            f.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION))
+            f.write(bytes(STORE_START - STORE_HEADER.size))
+        with open(f"{path}.idx", "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, STORE_VERSION, n_buckets))
+            f.write(bytes(INDEX_START - INDEX_HEADER.size + I64.size * n_buckets))
+        return cls(path, writable=True)
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        mode = "r+b" if writable else "rb"
+        access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        self.data_file = self.index_file = self.data = self.index = None
+        try:
+            self.data_file = open(path, mode)
+            self.index_file = open(f"{path}.idx", mode)
+            if os.fstat(self.data_file.fileno()).st_size < STORE_START \
+                    or os.fstat(self.index_file.fileno()).st_size < INDEX_START:
+                raise ValueError(f"{path} is not a version {STORE_VERSION} user store")
+            self.data = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.index = mmap.mmap(self.index_file.fileno(), 0, access=access)
+
+            magic, version = STORE_HEADER.unpack_from(self.data)
+            index_magic, index_version, self.n_buckets = INDEX_HEADER.unpack_from(self.index)
+            if (magic, index_magic) != (STORE_MAGIC, INDEX_MAGIC) \
+                    or version != STORE_VERSION or index_version != STORE_VERSION:
+                raise ValueError(f"{path} is not a version {STORE_VERSION} user store")
+            if self.n_buckets < 1:
+                raise ValueError(f"{path}.idx has a corrupt header ({self.n_buckets} buckets)")
+            size = INDEX_START + I64.size * self.n_buckets
+            if len(self.index) != size:
+                raise ValueError(f"{path}.idx is {len(self.index)} bytes, "
+                                 f"but its header says {size}")
+        except BaseException:
+            self.close()
+            raise
+
+    def __repr__(self):
+        return f"UserStore({self.path!r}, writable={self.writable})"
+
+    def bucket(self, name):
+        return INDEX_START + I64.size * (name_hash(name) % self.n_buckets)
+
+    def append(self, user):
+        if not self.writable:
+            raise ValueError("store was opened read-only")
+        bucket = self.bucket(user.name)
+        (head,) = I64.unpack_from(self.index, bucket)
+        record = bytearray(I64.pack(head))
+        encode_user(user, record)
+
+        offset = self.data_file.seek(0, os.SEEK_END)
+        self.data_file.write(record)
+        self.data_file.flush()
+        I64.pack_into(self.index, bucket, offset)
+
+    def extend(self, users):
+        for user in users:
+            self.append(user)
+
+    # latest user named name, or None
+    def get(self, name):
+        (offset,) = I64.unpack_from(self.index, self.bucket(name))
+        if offset >= len(self.data):
+            # appended since we mapped the data file
+            self.data.close()
+            self.data = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.data)
+        try:
+            while offset:
+                (previous,) = I64.unpack_from(view, offset)
+                record_name, _ = _decode_str(view, offset + I64.size)
+                if record_name == name:
+                    return decode_user(view, offset + I64.size)[0]
+                offset = previous
+            return None
+        finally:
+            view.release()
+
+    def __getitem__(self, name):
+        user = self.get(name)
+        if user is None:
+            raise KeyError(name)
+        return user
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def close(self):
+        for f in (self.data, self.index, self.data_file, self.index_file):
+            if f is not None:
+                f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+"""
+Friendship index
+
+has_friend scans both users' friends lists. FriendIndex gives every name
+an integer ID and keeps each user's friends as a set of IDs, so
+has_friend, mutual_friends and degree don't scan anything.
+Users are told apart by name, as in has_friend. The index follows changes
+made through FriendIndex.add_friend (or FriendIndex.update after changing
+a user's friends directly), one user at a time.
+"""
+
+class FriendIndex:
+    def __init__(self, users=()):
+        self.ids = {}
+        self.names = []
+        # friends[i] is the set of IDs of the friends of the user named names[i]
+        self.friends = []
+        for user in users:
+            self.update(user)
+
+    def __repr__(self):
+        return f"FriendIndex(names={len(self.names)})"
+
+    def intern(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.friends.append(set())
+        return i
+
+    # make the index match user.friends
+    def update(self, user):
+        self.friends[self.intern(user.name)] = {self.intern(f) for f in user.friends}
+
+    # add_friend, keeping the index up to date
+    def add_friend(self, user, other):
+        add_friend(user, other)
+        self.update(user)
+
+    def friend_ids(self, user):
+        i = self.ids.get(user.name)
+        return set() if i is None else self.friends[i]
+
+    # same as has_friend(user, other)
+    def has_friend(self, user, other):
+        i, j = self.ids.get(user.name), self.ids.get(other.name)
+        return i is not None and j is not None \
+            and j in self.friends[i] and i in self.friends[j]
+
+    # names on both users' friends lists
+    def mutual_friends(self, user, other):
+        return {self.names[i] for i in self.friend_ids(user) & self.friend_ids(other)}
+
+    def degree(self, user):
+        return len(self.friend_ids(user))
+
+"""
+Friend recommendations
+
+"People you may know", for every user at once: the users other than
+themselves, and not already on their friends list, who share the most
+friends with them (as in FriendIndex.mutual_friends).
+The friends lists become a sparse adjacency matrix A in CSR form (row i of
+A lists the IDs of the friends of name i), so the mutual friend counts are
+the entries of A @ A.T. The product is computed with NumPy a chunk of rows
+at a time, with the chunks sized so that the arrays for the
+friend-of-friend paths expanded for one chunk fit in memory_budget bytes
+(short of a single row with more paths than that, which gets a chunk to
+itself).
+memory_budget doesn't cover what's needed before the first chunk: the
+FriendIndex (a Python set per user) and the CSR arrays, which grow with
+the number of users and friendships whatever the budget. With 20,000
+users of 20 friends each, those take about 60 MiB, and the chunks' arrays
+come on top of that.
+"""
+
+# (indptr, indices) of the CSR matrix with a row per name in a FriendIndex,
+# and of its transpose if transpose is set
+def friend_matrix(index, transpose=False):
+    np = numpy_for("friend recommendations")
+    n = len(index.names)
+    degrees = np.fromiter(map(len, index.friends), dtype=np.int64, count=n)
+    rows = np.repeat(np.arange(n, dtype=np.int64), degrees)
+    cols = np.fromiter((j for friends in index.friends for j in friends),
+                       dtype=np.int64, count=len(rows))
+    if transpose:
+        rows, cols = cols, rows
+    order = np.lexsort((cols, rows))
+    indptr = np.searchsorted(rows[order], np.arange(n + 1))
+    return indptr, cols[order]
+
+# bytes of NumPy arrays per friend-of-friend path in recommend_friends: at
+# most three int64 arrays and a bool array with an entry per path of the
+# chunk are alive at once, plus those with an entry per friendship or row,
+# which count as paths too. That comes to at most about 30 bytes a path,
+# as measured with tracemalloc, so this leaves some room
+PATH_BYTES = 40
+
+# yields (name, [(candidate, mutual friends), ...]) for every user, with at
+# most k candidates, most mutual friends first (then first seen first)
+def recommend_friends(users, k=10, memory_budget=1 << 26):
+    np = numpy_for("friend recommendations")
+    users = list(users)
+    index = FriendIndex(users)
+    n = len(index.names)
+    indptr, indices = friend_matrix(index)
+    t_indptr, t_indices = friend_matrix(index, transpose=True)
+    degrees = np.diff(indptr)
+    is_user = np.zeros(n, dtype=bool)
+    is_user[[index.ids[user.name] for user in users]] = True
+
+    # paths u -> friend <- candidate from each row, plus one for each
+    # friendship and the row itself, and a chunk's worth
+    paths = degrees + 1
+    np.add.at(paths, np.repeat(np.arange(n), degrees), np.diff(t_indptr)[indices])
+    total_paths = np.concatenate(([0], np.cumsum(paths)))
+    chunk_paths = max(1, memory_budget // PATH_BYTES)
+    # rows in a chunk, so that the sort keys below fit in an int64
+    most_mutual = int(degrees.max(initial=0))
+    chunk_rows = max(1, (2**63 - 1) // (max(n, 1) * (most_mutual + 2)))
+
+    start = 0
+    while start < n:
+        end = int(np.searchsorted(total_paths, total_paths[start] + chunk_paths, side='right')) - 1
+        end = min(max(end, start + 1), start + chunk_rows, n)
+        m = end - start
+
+        # the friends of each row in the chunk (rows counted from start),
+        # who aren't candidates, and neither is the row itself ...
+        rows = np.repeat(np.arange(m), degrees[start:end])
+        friends = indices[indptr[start]:indptr[end]]
+        excluded = np.concatenate((rows * n + friends, np.arange(start, start + m * (n + 1), n + 1)))
+        excluded.sort()
+        # ... and everyone else who has them as a friend (each friend has at
+        # least the row), the ranges t_indptr[f]:t_indptr[f + 1] of t_indices
+        # end to end, as a running sum of 1s with a jump between ranges
+        firsts = t_indptr[friends]
+        counts = t_indptr[friends + 1] - firsts
+        positions = np.ones(counts.sum(), dtype=np.int64)
+        if len(positions):
+            positions[0] = firsts[0]
+            firsts[1:] -= firsts[:-1] + counts[:-1] - 1
+            positions[np.cumsum(counts[:-1])] = firsts[1:]
+            np.cumsum(positions, out=positions)
+        del firsts
+
+        # one key, row * n + candidate, per path, sorted, so that the paths
+        # to each (row, candidate) pair are a run of equal keys
+        keys = t_indices[positions]
+        del positions
+        keys += np.repeat(rows * n, counts)
+        del rows, counts
+        keys.sort()
+        starts = np.empty(len(keys), dtype=bool)
+        starts[:1] = True
+        np.not_equal(keys[1:], keys[:-1], out=starts[1:])
+        starts = np.flatnonzero(starts)
+        mutual = np.empty(len(starts), dtype=np.int64)
+        mutual[:-1] = starts[1:]
+        mutual[-1:] = len(keys)
+        mutual -= starts
+        keys = keys[starts]
+        del starts
+        # (the pairs that aren't candidates count as no mutual friends, and
+        # are dropped below)
+        found = np.searchsorted(keys, excluded)
+        hit = found < len(keys)
+        found, excluded = found[hit], excluded[hit]
+        mutual[found[keys[found] == excluded]] = 0
+
+        # best k per row: sorted by row, then most mutual friends, then
+        # candidate, by key ((row * (most + 1) + most - mutual) * n + candidate)
+        most = int(mutual.max(initial=0))
+        order = keys // n
+        order *= most
+        order += most
+        order -= mutual
+        order *= n
+        keys += order
+        del order, mutual
+        keys.sort()
+        scale = (most + 1) * n
+        bounds = np.searchsorted(keys, np.arange(m + 1) * scale)
+        for i in np.flatnonzero(is_user[start:end]):
+            best = keys[bounds[i]:min(bounds[i] + k, bounds[i + 1])]
+            best = best[best % scale < most * n]
+            yield index.names[start + i], [
+                (index.names[c], most - r) for r, c in zip((best % scale // n).tolist(),
+                                                           (best % n).tolist())]
+        start = end
+
+"""
+Bulk friendships
+
+add_friend replaces the friends list, as specified above. add_friends is
+for loading friendships in bulk instead: it takes a stream of
+(name, friend name) pairs, e.g. read from a file, and appends each friend
+to that user's friends list, unless it's already there. The friends lists
+already seen are kept as sets alongside, so each pair is checked in O(1)
+time however many friends the user has, and nothing is kept per pair.
+With symmetric=True each pair also makes the user a friend of the friend.
+Pairs naming someone who isn't one of the users are skipped.
+"""
+
+# returns the number of names appended to friends lists
+def add_friends(users, edges, symmetric=False):
+    by_name = {user.name: user for user in users}
+    # known[name] is the set of names on the friends list of the user called
+    # name, and that list's append method
+    known = {}
+    if symmetric:
+        edges = chain.from_iterable(((name, friend), (friend, name)) for name, friend in edges)
+
+    added = 0
+    for name, friend in edges:
+        entry = known.get(name)
+        if entry is None:
+            user = by_name.get(name)
+            if user is None:
+                continue
+            entry = known[name] = set(user.friends), user.friends.append
+        friends, append = entry
+        if friend not in friends:
+            friends.add(friend)
+            append(friend)
+            added += 1
+    return added
+
+"""
+Waiting for the server without blocking
+
+user_from_server spins on server_response, keeping a core busy for as long
+as the server is away, which may be forever. user_from_server_async polls
+with exponential backoff instead, sleeping (and letting the event loop run
+other tasks) between polls, and raises TimeoutError once timeout seconds
+have passed; cancelling it stops it at the next poll or sleep.
+poll may be any function like server_response, or a coroutine function.
+The response is parsed in a worker thread, off the event loop.
+StandInServer stands in for the server in tests, answering after a delay.
+asyncio is only imported when needed: it takes longer to import than the
+rest of this file.
+"""
+
+# user_from_server's parsing, with commas allowed in the friends list
+def parse_user(response):
+    name, age, friends = response.split(",", 2)
+    return User(name, int(age), friends.split(","))
+
+async def _poll_user(poll, first_delay, max_delay):
+    import asyncio
+    import inspect
+    delay = first_delay
+    while True:
+        response = poll()
+        if inspect.isawaitable(response):
+            response = await response
+        if response is not None:
+            return await asyncio.get_running_loop().run_in_executor(None, parse_user, response)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+async def user_from_server_async(poll=server_response, timeout=10.0,
+                                 first_delay=0.001, max_delay=1.0):
+    import asyncio
+    try:
+        return await asyncio.wait_for(_poll_user(poll, first_delay, max_delay), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"no response from the server in {timeout}s") from None
+
+class StandInServer:
+    # a server_response that returns response once delay seconds have
+    # passed, or never if delay is None
+    def __init__(self, response, delay=None):
+        self.response = response
+        self.ready_at = None if delay is None else time.monotonic() + delay
+        self.polls = 0
+
+    def __call__(self):
+        self.polls += 1
+        if self.ready_at is not None and time.monotonic() >= self.ready_at:
+            return self.response
+        return None
+
+"""
+Fetching many users
+
+user_from_server gets one user per round trip. fetch_users asks a server
+for many users, by ID, over a small pool of TCP connections: each
+request is a line "<tag> <id>" and each response a line "<tag> <response>"
+(or just "<tag>" if there's no such user), where the tag tells responses
+apart, so several requests can be in flight on one connection at once and
+answered in any order. At most concurrency requests are in flight (or
+answered but not yet consumed) at a time.
+fetch_users yields (id, user) pairs as the responses arrive, where user is
+a User, or else an exception: KeyError if the server has no such user,
+TimeoutError if it didn't answer in timeout seconds, ConnectionError if
+the connection was lost and ValueError if the response didn't parse (as
+score_lines does with its errors).
+StandInUserServer is a local server to test and benchmark it with, which
+takes latency seconds to answer each request.
+"""
+
+class _UserConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}
+        self.next_tag = 0
+        # requests given to this connection and not yet answered
+        self.active = 0
+        # set once the server has closed the connection (or it broke)
+        self.closed = False
+
+    async def read_responses(self):
+        try:
+            while line := await self.reader.readline():
+                tag, _, response = line.decode().rstrip("\n").partition(" ")
+                future = self.pending.pop(int(tag), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.closed = True
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("connection to the server lost"))
+
+    async def request(self, id, timeout):
+        import asyncio
+        if self.closed:
+            raise ConnectionError("connection to the server lost")
+        tag = self.next_tag
+        self.next_tag += 1
+        future = self.pending[tag] = asyncio.get_running_loop().create_future()
+        self.writer.write(f"{tag} {id}\n".encode())
+        try:
+            await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(tag, None)
+
+# yields (id, User or exception) for each of ids, as they arrive
+async def fetch_users(ids, host, port, concurrency=32, connections=4, timeout=5.0):
+    import asyncio
+    pool = []
+    readers = []
+    tasks = set()
+    results = asyncio.Queue()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def fetch(connection, id):
+        try:
+            response = await connection.request(id, timeout)
+            user = parse_user(response) if response else KeyError(id)
+        except asyncio.TimeoutError:
+            user = TimeoutError(f"no response for {id!r} in {timeout}s")
+        except (ConnectionError, OSError) as e:
+            user = ConnectionError(f"can't fetch {id!r}: {e}")
+        except ValueError as e:
+            user = ValueError(f"can't parse the response for {id!r}: {e}")
+        finally:
+            connection.active -= 1
+        await results.put((id, user))
+
+    async def send_all():
+        try:
+            for id in ids:
+                await slots.acquire()
+                # forget lost connections, and open a new one when all the
+                # others are busy
+                pool[:] = [c for c in pool if not c.closed]
+                if len(pool) < connections and all(c.active for c in pool):
+                    connection = _UserConnection(*await asyncio.open_connection(host, port))
+                    readers.append(asyncio.create_task(connection.read_responses()))
+                    pool.append(connection)
+                # the connection with the fewest requests in flight
+                connection = min(pool, key=lambda c: c.active)
+                connection.active += 1
+                task = asyncio.create_task(fetch(connection, id))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            while tasks:
+                await asyncio.wait(tasks)
+        finally:
+            # no more results
+            await results.put(None)
+
+    sender = asyncio.create_task(send_all())
+    try:
+        while (result := await results.get()) is not None:
+            yield result
+            slots.release()
+        # raises anything send_all raised
+        await sender
+    finally:
+        for task in [sender, *tasks, *readers]:
+            task.cancel()
+        for connection in pool:
+            connection.writer.close()
+
+class StandInUserServer:
+    # serves responses[id] for each request, latency seconds after it
+    # arrives, on a free port on localhost, and closes each connection
+    # after replies_per_connection replies (if given)
+    def __init__(self, responses, latency=0.0, replies_per_connection=None):
+        self.responses = responses
+        self.latency = latency
+        self.replies_per_connection = replies_per_connection
+        self.replies = {}
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.handlers = {}
+
+    async def __aenter__(self):
+        import asyncio
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        self.host, self.port = self.server.sockets[0].getsockname()[:2]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        import asyncio
+        self.server.close()
+        # closing the connections ends the handlers, which asyncio doesn't
+        # like to see cancelled
+        for writer in self.handlers.values():
+            writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def answer(self, writer, line):
+        import asyncio
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            tag, _, id = line.decode().rstrip("\n").partition(" ")
+            response = self.responses.get(id)
+            writer.write(f"{tag} {response}\n".encode() if response else f"{tag}\n".encode())
+            self.replies[writer] += 1
+            if self.replies[writer] == self.replies_per_connection:
+                writer.close()
+        finally:
+            self.in_flight -= 1
+
+    async def serve(self, reader, writer):
+        import asyncio
+        self.connections += 1
+        self.handlers[asyncio.current_task()] = writer
+        self.replies[writer] = 0
+        answers = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self.answer(writer, line))
+                answers.add(task)
+                task.add_done_callback(answers.discard)
+        except ConnectionError:
+            pass
+        finally:
+            for task in answers:
+                task.cancel()
+            writer.close()
+            del self.handlers[asyncio.current_task()]
+            del self.replies[writer]
@@ -46,6 +46,19 @@ For example:
 ```
     python3 part3.py 1 5 10 20 100
 ```
+To find the best set of k denominations up to some value, use the search
+command, e.g. `python3 part3.py search -k 5 --max-value 100`, and to list
+the best tradeoffs between the number of denominations and the average,
+use `python3 part3.py pareto --max-value 100 --max-k 4`.
+To score many sets of denominations at once, one per line of a file (or of
+stdin), use `python3 part3.py batch <file>`, which prints one JSON result
+per line.
+
+To average over a different range of amounts, pass -N, and choose how the
+average is computed with --engine (see ENGINES). For example:
+```
+    python3 part3.py 1 5 10 20 100 -N 1000000000000 --engine periodic
+```
 You can run your tests by running `pytest part3.py`.
 
 === Problem description ===
@@ -83,9 +96,21 @@ Are there some of these simpler cases where you can easily predict what the outp
 should be?
 """
 
-import pytest
+# pytest and Hypothesis are only loaded when testing, see testdeps.py
+from testdeps import pytest
+
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict, deque
+from itertools import accumulate
+from typing import Callable, Dict, List, Tuple
 
-from typing import List
+from numpydeps import numpy_for
 
 DEFAULT_N = 100
 
@@ -104,20 +129,912 @@ def min_next(i: int, denoms: List[int], bills_for: List[int]) -> int:
         if i - d >= 0
     ])
 
+# minimum number of bills for every value from 0 to N
+def bills_table(denoms: List[int], N: int) -> List[int]:
+    bills_for = [0]
+    for i in range(1, N+1):
+        best = min_next(i, denoms, bills_for)
+        bills_for.append(best)
+    return bills_for
+
+def python_avg(denoms: List[int], N: int) -> float:
+    bills_for = bills_table(denoms, N)
+
+    # return sum of all costs over the total number of costs
+    return sum(bills_for) / len(bills_for)
+
 # avg # of bills to create a random value from 1 to N
-def get_avg(denoms: List[int], N=DEFAULT_N) -> float:
+# (engine selects how the table of bills is computed, see ENGINES).
+# With weights (N + 1 of them, or a path to a .npy histogram), amount i
+# is weights[i] times as likely instead, see weighted_avg.
+# With a stats sink, measurements of the DP are recorded to it, see instrumented_avg.
+# Both need an engine that builds a table (see TABLE_ENGINES), and they
+# can't be combined.
+def get_avg(denoms: List[int], N=DEFAULT_N, engine: str = "python", weights=None,
+            stats=None) -> float:
     if 1 not in denoms:
         print("Warning: first denomination should be 1")
         # return infinity
         return float('inf')
 
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine {engine!r}, expected one of {sorted(ENGINES)}")
+    if weights is not None:
+        if stats is not None:
+            raise ValueError("weighted averages can't be instrumented")
+        return weighted_avg(denoms, N, weights, engine=engine)
+    if stats is not None:
+        return instrumented_avg(denoms, N, engine, stats)
+    return ENGINES[engine](denoms, N)
+
+"""
+NumPy engine
+
+Same table as bills_table, kept in a NumPy integer array.
+Since 1 is always a denomination, the table starts out as bills_for[i] = i,
+and each larger denomination d is then folded in with one vectorized pass:
+laying the table out in rows of d amounts, every column is a residue
+class mod d, and using d once more costs one bill per row, so
+
+    new[r + k*d] = k + min(old[r + j*d] - j for j <= k)
+
+which is a running minimum down the columns (np.minimum.accumulate).
+"""
+
+# NumPy, which is optional, for the 'numpy' engine
+def _numpy():
+    return numpy_for("the 'numpy' engine")
+
+def numpy_bills_table(denoms: List[int], N: int):
+    np = _numpy()
+    bills_for = np.arange(N + 1, dtype=np.int64)
+    for d in sorted(set(denoms)):
+        if d < 1:
+            raise ValueError(f"denominations must be positive, got {d}")
+        if d == 1 or d > N:
+            continue
+        rows = -(-(N + 1) // d)
+        # pad the last row with values that can never be the minimum
+        grid = np.full(rows * d, N + rows, dtype=np.int64)
+        grid[:N + 1] = bills_for
+        grid = grid.reshape(rows, d)
+        k = np.arange(rows, dtype=np.int64)[:, None]
+        grid -= k
+        np.minimum.accumulate(grid, axis=0, out=grid)
+        grid += k
+        bills_for = grid.reshape(-1)[:N + 1]
+    return bills_for
+
+def numpy_avg(denoms: List[int], N: int) -> float:
+    bills_for = numpy_bills_table(denoms, N)
+    return int(bills_for.sum()) / len(bills_for)
+
+"""
+Instrumentation
+
+get_avg(..., stats=sink) runs the python or numpy engine in two timed
+phases (building the table, then reducing it to the average) and passes
+sink.record a dict of measurements:
+
+    engine, N
+    cells           amounts computed
+    comparisons     comparisons the engine makes between candidate bill
+                    counts: in min_next's min for python, and in
+                    np.minimum.accumulate for numpy
+    build_seconds   time to build the table
+    reduce_seconds  time to sum it up
+    table_bytes     size of the finished table (for python, the list and
+                    the int objects in it that aren't shared small ints)
+
+table_bytes is not the peak memory of building the table: the numpy
+engine also holds a padded copy of the table while folding in each
+denomination.
+Any object with a record method is a sink. StatsSink adds them up in
+memory and can dump them in Prometheus text format, LoggingSink logs each
+call, and PrometheusFileSink keeps a Prometheus text file up to date.
+Without a sink get_avg doesn't measure anything.
+"""
+
+# min_next compares the candidates from every denomination d <= i
+def python_comparisons(denoms: List[int], N: int) -> int:
+    return sum(max(0, N - d + 1) for d in denoms) - N
+
+# each denomination's np.minimum.accumulate goes down d columns of rows
+def numpy_comparisons(denoms: List[int], N: int) -> int:
+    return sum((-(-(N + 1) // d) - 1) * d for d in set(denoms) if 1 < d <= N)
+
+def python_table_bytes(bills_for: List[int]) -> int:
+    # ints up to 256 are preallocated and shared
+    return sys.getsizeof(bills_for) + sum(sys.getsizeof(b) for b in bills_for if b > 256)
+
+# engines that build a table: how to build it, sum it, count the
+# comparisons building it makes and measure it
+TABLE_ENGINES = {
+    "python": (bills_table, sum, python_comparisons, python_table_bytes),
+    "numpy": (numpy_bills_table, lambda bills_for: int(bills_for.sum()), numpy_comparisons,
+              lambda bills_for: bills_for.nbytes),
+}
+
+def instrumented_avg(denoms: List[int], N: int, engine: str, sink) -> float:
+    if engine not in TABLE_ENGINES:
+        raise ValueError(f"only the {sorted(TABLE_ENGINES)} engines can be instrumented, "
+                         f"not {engine!r}")
+    build, reduce, comparisons, table_bytes = TABLE_ENGINES[engine]
+
+    start = time.perf_counter()
+    bills_for = build(denoms, N)
+    built = time.perf_counter()
+    total = reduce(bills_for)
+    reduced = time.perf_counter()
+
+    sink.record({
+        "engine": engine,
+        "N": N,
+        "cells": N,
+        "comparisons": comparisons(denoms, N),
+        "build_seconds": built - start,
+        "reduce_seconds": reduced - built,
+        "table_bytes": table_bytes(bills_for),
+    })
+    return total / len(bills_for)
+
+class StatsSink:
+    COUNTERS = ["calls", "cells", "comparisons", "build_seconds", "reduce_seconds"]
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        # of the finished tables, see table_bytes above
+        self.largest_table_bytes = 0
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)}"
+                           for name in self.COUNTERS + ["largest_table_bytes"])
+        return f"StatsSink({fields})"
+
+    def record(self, measurements: dict):
+        self.calls += 1
+        for name in self.COUNTERS[1:]:
+            setattr(self, name, getattr(self, name) + measurements[name])
+        self.largest_table_bytes = max(self.largest_table_bytes, measurements["table_bytes"])
+
+    # Prometheus text exposition format
+    def prometheus(self, prefix: str = "part3_get_avg") -> str:
+        lines = []
+        for name in self.COUNTERS:
+            metric = f"{prefix}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {getattr(self, name)}"]
+        metric = f"{prefix}_largest_table_bytes"
+        lines += [f"# TYPE {metric} gauge", f"{metric} {self.largest_table_bytes}"]
+        return "\n".join(lines) + "\n"
+
+class LoggingSink:
+    def __init__(self, logger=None, level=None):
+        # imported here, so that get_avg without instrumentation doesn't pay for it
+        import logging
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = logging.INFO if level is None else level
+
+    def record(self, measurements: dict):
+        self.logger.log(self.level, "get_avg %s", " ".join(
+            f"{name}={value}" for name, value in measurements.items()
+        ))
+
+# StatsSink that rewrites path (e.g. for node_exporter's textfile collector)
+# after every call
+class PrometheusFileSink(StatsSink):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def record(self, measurements: dict):
+        super().record(measurements)
+        tmp = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, self.path)
+
+"""
+Weighted averages
+
+Expected number of bills when amounts aren't equally likely: weights[i] is
+the relative likelihood of amount i. The table comes from the python or
+numpy engine and is reduced with NumPy dot products, chunk amounts at a
+time, so histograms can be memory-mapped instead of read into memory.
+"""
+
+# memory-mapped histogram saved with np.save
+def load_weights(path):
+    return _numpy().load(path, mmap_mode='r')
+
+def weighted_avg(denoms: List[int], N: int, weights, chunk: int = 2**20,
+                 engine: str = "numpy") -> float:
+    np = _numpy()
+    if engine not in TABLE_ENGINES:
+        raise ValueError(f"weighted averages need the {sorted(TABLE_ENGINES)} engines, "
+                         f"not {engine!r}")
+    if isinstance(weights, (str, os.PathLike)):
+        weights = load_weights(weights)
+    if len(weights) != N + 1:
+        raise ValueError(f"expected N + 1 = {N + 1} weights, got {len(weights)}")
+
+    build = TABLE_ENGINES[engine][0]
+    bills_for = build(denoms, N)
+    total = 0.0
+    total_weight = 0.0
+    for start in range(0, N + 1, chunk):
+        w = np.asarray(weights[start:start + chunk], dtype=np.float64)
+        total += float(w @ np.asarray(bills_for[start:start + chunk], dtype=np.float64))
+        total_weight += float(w.sum())
+    if total_weight <= 0:
+        raise ValueError("weights must have a positive sum")
+    return total / total_weight
+
+"""
+Average curve
+
+get_avg for every N from 0 to N_max at once: one table, whose prefix sums
+divided by the number of amounts give all of the averages.
+"""
+
+# curve[N] == get_avg(denoms, N) for every N from 0 to N_max. With a path,
+# the curve is written (chunk amounts at a time) to a .npy file and returned
+# memory-mapped; np.load(path, mmap_mode='r') reads it back the same way.
+def avg_curve(denoms: List[int], N_max: int, path=None, chunk: int = 2**20):
+    np = _numpy()
+    if path is None:
+        curve = np.empty(N_max + 1, dtype=np.float64)
+    else:
+        curve = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                          shape=(N_max + 1,))
+    if 1 not in denoms:
+        print("Warning: first denomination should be 1")
+        curve[:] = float('inf')
+        return curve
+
+    bills_for = numpy_bills_table(denoms, N_max)
+    total = 0
+    for start in range(0, N_max + 1, chunk):
+        prefix = np.cumsum(bills_for[start:start + chunk]) + total
+        curve[start:start + len(prefix)] = \
+            prefix / np.arange(start + 1, start + len(prefix) + 1)
+        total = int(prefix[-1])
+    if path is not None:
+        curve.flush()
+    return curve
+
+"""
+Table cache
+
+Keeps the bills table and its prefix sums per set of denominations, so that
+repeated calls with the same denominations only compute amounts they
+haven't seen yet. Entries are evicted least recently used first once the
+tables take up more than max_bytes.
+"""
+
+class TableCache:
+    def __init__(self, max_bytes: int = 64 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.extensions = 0
+        self.evictions = 0
+        # denominations -> (bills_for, prefix), where prefix[i] = sum(bills_for[:i+1])
+        self.entries: "OrderedDict[Tuple[int, ...], Tuple[array, array]]" = OrderedDict()
+
+    def __repr__(self):
+        return f"TableCache(entries={len(self.entries)}, nbytes={self.nbytes}, " \
+            f"hits={self.hits}, misses={self.misses}, " \
+            f"extensions={self.extensions}, evictions={self.evictions})"
+
+    @staticmethod
+    def entry_bytes(entry: Tuple[array, array]) -> int:
+        return sum(len(a) * a.itemsize for a in entry)
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    # sum of bills_for[0..N], computing only the missing part of the table
+    def total(self, denoms: List[int], N: int) -> int:
+        key = tuple(sorted(set(denoms)))
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            entry = (array('q', [0]), array('q', [0]))
+        elif N < len(entry[0]):
+            self.hits += 1
+            self.entries[key] = entry
+            return entry[1][N]
+        else:
+            self.extensions += 1
+            self.nbytes -= self.entry_bytes(entry)
+
+        bills_for, prefix = entry
+        total = prefix[-1]
+        for i in range(len(bills_for), N+1):
+            best = min_next(i, key, bills_for)
+            bills_for.append(best)
+            total += best
+            prefix.append(total)
+
+        self.store(key, entry)
+        return total
+
+    def store(self, key: Tuple[int, ...], entry: Tuple[array, array]):
+        size = self.entry_bytes(entry)
+        if size > self.max_bytes:
+            return
+        while self.nbytes + size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= self.entry_bytes(evicted)
+            self.evictions += 1
+        self.entries[key] = entry
+        self.nbytes += size
+
+TABLE_CACHE = TableCache()
+
+def cached_avg(denoms: List[int], N: int) -> float:
+    return TABLE_CACHE.total(denoms, N) / (N + 1)
+
+"""
+Making change
+
+Besides how many bills each amount takes, ChangeTable records which
+denomination the DP picked last for it (as an index into the sorted
+denominations, one byte per amount), so the bills for any amount can be
+read back by following those choices, one bill at a time.
+"""
+
+class ChangeTable:
+    def __init__(self, denoms: List[int], N=DEFAULT_N):
+        if 1 not in denoms:
+            raise ValueError("first denomination should be 1")
+        self.denoms = sorted(set(denoms))
+        if len(self.denoms) > 256:
+            raise ValueError("at most 256 denominations fit in a one-byte choice")
+        self.N = N
+
+        bills_for = array('q', [0])
+        choice = array('B', [0])
+        for i in range(1, N+1):
+            best, k = min([
+                (1 + bills_for[i - d], k)
+                for k, d in enumerate(self.denoms)
+                if i - d >= 0
+            ])
+            bills_for.append(best)
+            choice.append(k)
+        self.bills_for = bills_for
+        self.choice = choice
+
+    def __repr__(self):
+        return f"ChangeTable(denoms={self.denoms}, N={self.N})"
+
+    def avg(self) -> float:
+        return sum(self.bills_for) / len(self.bills_for)
+
+    # the bills making up amount, with as few bills as possible
+    def bills(self, amount: int) -> List[int]:
+        if not 0 <= amount <= self.N:
+            raise IndexError(f"amount {amount} not in 0..{self.N}")
+        bills = []
+        while amount > 0:
+            d = self.denoms[self.choice[amount]]
+            bills.append(d)
+            amount -= d
+        return bills
+
+"""
+Table files
+
+A computed table can be saved to a file that any number of processes open
+read-only with mmap, so they share one copy through the page cache and
+bills_for[i] or the average over any range of amounts are lookups into
+the mapped file instead of a DP. The file is
+
+    header: magic, format version, bytes per bill count, byte order,
+            number of denominations, N
+    denominations (int64, sorted)
+    prefix sums of the table (int64, N + 1 of them)
+    the table itself (unsigned, as few bytes per entry as fit)
+
+all in the byte order of the machine that wrote it.
+"""
+
+TABLE_MAGIC = b"BILLTBL\0"
+TABLE_VERSION = 1
+TABLE_HEADER = struct.Struct("<8sHBBqq")
+# unsigned array typecode for each number of bytes per entry
+TABLE_TYPECODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+BYTE_ORDERS = {'little': 0, 'big': 1}
+
+def save_table(path, denoms: List[int], N=DEFAULT_N, engine: str = "python"):
+    if 1 not in denoms:
+        raise ValueError("first denomination should be 1")
+    denoms = sorted(set(denoms))
+    if engine == "numpy":
+        np = _numpy()
+        bills_for = numpy_bills_table(denoms, N)
+        prefix = np.cumsum(bills_for)
+        largest = int(bills_for.max())
+    elif engine == "python":
+        bills_for = bills_table(denoms, N)
+        prefix = array('q', accumulate(bills_for))
+        largest = max(bills_for)
+    else:
+        raise ValueError(f"tables can only be built by the python or numpy engine, not {engine!r}")
+    itemsize = next(size for size in TABLE_TYPECODES if largest < 2 ** (8 * size))
+    typecode = TABLE_TYPECODES[itemsize]
+    if engine == "numpy":
+        bills_for = bills_for.astype(f"u{itemsize}")
+    else:
+        bills_for = array(typecode, bills_for)
+
+    # write next to the final file and rename, so readers never see half a table
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, itemsize,
+                                  BYTE_ORDERS[sys.byteorder], len(denoms), N))
+        f.write(bytes(-TABLE_HEADER.size % 8))
+        f.write(array('q', denoms).tobytes())
+        f.write(prefix.tobytes())
+        f.write(bills_for.tobytes())
+    os.replace(tmp, path)
+
+class BillsTable:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, itemsize, byteorder, k, N = \
+                TABLE_HEADER.unpack_from(self.mmap)
+        except struct.error:
+            magic = None
+        if magic != TABLE_MAGIC:
+            self.mmap.close()
+            raise ValueError(f"{path} is not a bills table")
+        if version != TABLE_VERSION or byteorder != BYTE_ORDERS[sys.byteorder]:
+            self.mmap.close()
+            raise ValueError(f"{path} has table version {version} with byte order "
+                             f"{byteorder}, expected version {TABLE_VERSION} "
+                             f"with byte order {BYTE_ORDERS[sys.byteorder]}")
+        start = TABLE_HEADER.size + -TABLE_HEADER.size % 8
+        if itemsize not in TABLE_TYPECODES or k < 0 or N < 0:
+            self.mmap.close()
+            raise ValueError(f"{path} has a corrupt header ({itemsize} bytes per entry, "
+                             f"{k} denominations, N={N})")
+        size = start + 8 * k + (8 + itemsize) * (N + 1)
+        if len(self.mmap) != size:
+            actual = len(self.mmap)
+            self.mmap.close()
+            raise ValueError(f"{path} is {actual} bytes, but its header says {size}")
+
+        self.N = N
+        view = memoryview(self.mmap)
+        sections = []
+        for typecode, size, count in [('q', 8, k), ('q', 8, N + 1),
+                                      (TABLE_TYPECODES[itemsize], itemsize, N + 1)]:
+            sections.append(view[start:start + size * count].cast(typecode))
+            start += size * count
+        view.release()
+        denoms, self.prefix, self.bills_for = sections
+        self.denoms = denoms.tolist()
+        denoms.release()
+
+    def __repr__(self):
+        return f"BillsTable(denoms={self.denoms}, N={self.N})"
+
+    def __len__(self):
+        return self.N + 1
+
+    def __getitem__(self, i):
+        return self.bills_for[i]
+
+    # average over amounts lo..hi (by default 0..N, which is get_avg)
+    def avg(self, lo: int = 0, hi=None) -> float:
+        if hi is None:
+            hi = self.N
+        if not 0 <= lo <= hi <= self.N:
+            raise IndexError(f"amounts {lo}..{hi} not in 0..{self.N}")
+        before = self.prefix[lo - 1] if lo > 0 else 0
+        return (self.prefix[hi] - before) / (hi - lo + 1)
+
+    def close(self):
+        self.prefix.release()
+        self.bills_for.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+"""
+Periodic engine
+
+Let M = max(denoms). Once M consecutive amounts i >= M satisfy
+bills_for[i] == bills_for[i - M] + 1, every larger amount does too:
+each of its candidates i - d lies in that run, so shifting all of them
+down by M takes exactly one bill off the minimum.
+From there on the table repeats with period M, going up by one bill per
+period, so the total over 0..N is the prefix before the run plus
+arithmetic series over the periods, and very large N (10**12 and up)
+cost no more than finding the run.
+"""
+
+# bills table up to the start s of the periodic part, plus one period:
+# returns (bills_for, s) with len(bills_for) == s + M, or s = None if
+# the table isn't periodic yet by amount limit
+def periodic_table(denoms: List[int], limit=None) -> Tuple[List[int], int]:
+    M = max(denoms)
     bills_for = [0]
-    for i in range(1, N+1):
+    run = 0
+    i = 0
+    while run < M:
+        if i == limit:
+            return bills_for, None
+        i += 1
         best = min_next(i, denoms, bills_for)
         bills_for.append(best)
+        if i >= M and best == bills_for[i - M] + 1:
+            run += 1
+        else:
+            run = 0
+    return bills_for, i - M + 1
 
-    # return sum of all costs over the total number of costs
-    return sum(bills_for) / len(bills_for)
+def periodic_total(denoms: List[int], N: int) -> int:
+    bills_for, s = periodic_table(denoms, limit=N)
+    if N < len(bills_for):
+        return sum(bills_for[:N+1])
+
+    M = max(denoms)
+    period = bills_for[s:]
+    # amounts s..N are q full periods and r amounts into the next one
+    q, r = divmod(N - s + 1, M)
+    return sum(bills_for[:s]) \
+        + q * sum(period) + M * (q * (q - 1) // 2) \
+        + sum(period[:r]) + r * q
+
+def periodic_avg(denoms: List[int], N: int) -> float:
+    return periodic_total(denoms, N) / (N + 1)
+
+"""
+Canonical engine
+
+A system of denominations is canonical when greedily taking the largest
+denomination that fits always uses the fewest bills (US currency is).
+Pearson's O(n^3) test finds the smallest counterexample, if there is one,
+among the values reached by bumping up one denomination in the greedy
+representation of c - 1 for some denomination c and dropping the smaller
+ones. For canonical systems every amount is its number of largest
+denominations plus the greedy count of the remainder, so the total over
+0..N only needs the greedy table below the largest denomination. Other
+systems fall back to the DP, through the periodic engine so that large N
+stay cheap.
+get_avg(..., engine="canonical") returns just the average; call
+canonical_avg to also find out which of the two paths was taken.
+"""
+
+# number of each denomination (largest first) used by greedy change for x
+def greedy(x: int, denoms_desc: List[int]) -> List[int]:
+    counts = []
+    for d in denoms_desc:
+        counts.append(x // d)
+        x %= d
+    return counts
+
+# smallest amount for which greedy change isn't optimal, or None if the
+# denominations are canonical
+def canonical_counterexample(denoms: List[int]):
+    coins = sorted(set(denoms), reverse=True)
+    found = None
+    for i in range(1, len(coins)):
+        below = greedy(coins[i - 1] - 1, coins)
+        for j in range(i, len(coins)):
+            candidate = below[:j] + [below[j] + 1] + [0] * (len(coins) - j - 1)
+            w = sum(c * d for c, d in zip(candidate, coins))
+            if sum(greedy(w, coins)) > sum(candidate) and (found is None or w < found):
+                found = w
+    return found
+
+# (avg, "greedy") for canonical denominations, (avg, "dp") otherwise
+def canonical_avg(denoms: List[int], N: int) -> Tuple[float, str]:
+    if canonical_counterexample(denoms) is not None:
+        return periodic_avg(denoms, N), "dp"
+
+    coins = sorted(set(denoms))
+    M = coins[-1]
+    # greedy table for 0..M-1: one bill plus the greedy count of the rest
+    bills_for = [0]
+    largest = 0
+    for i in range(1, M):
+        while largest + 1 < len(coins) and coins[largest + 1] <= i:
+            largest += 1
+        bills_for.append(1 + bills_for[i - coins[largest]])
+    # amount q*M + r takes q bills of M plus bills_for[r]
+    q, r = divmod(N + 1, M)
+    total = q * sum(bills_for) + M * (q * (q - 1) // 2) + sum(bills_for[:r]) + r * q
+    return total / (N + 1), "greedy"
+
+# the canonical engine, without the path
+def greedy_avg(denoms: List[int], N: int) -> float:
+    return canonical_avg(denoms, N)[0]
+
+"""
+Rolling engine
+
+min_next only ever looks back max(denoms) amounts, so instead of the whole
+table we can keep the last M = max(denoms) entries in a ring buffer
+(bills for amount i lives at index i % M) and a running sum.
+This uses O(M) memory instead of O(N).
+"""
+
+def rolling_avg(denoms: List[int], N: int) -> float:
+    M = max(denoms)
+    ring = array('q', bytes(M * array('q').itemsize))
+    total = 0
+    for i in range(1, N+1):
+        best = min([
+            1 + ring[(i - d) % M]
+            for d in denoms
+            if i - d >= 0
+        ])
+        ring[i % M] = best
+        total += best
+    return total / (N + 1)
+
+ENGINES: Dict[str, Callable[[List[int], int], float]] = {
+    "python": python_avg,
+    "numpy": numpy_avg,
+    "cached": cached_avg,
+    "periodic": periodic_avg,
+    "rolling": rolling_avg,
+    "canonical": greedy_avg,
+}
+
+"""
+Batch scoring
+
+Scores many sets of denominations at once: the sets are padded (with extra
+1s, which don't change anything) into a 2-D array of denominations, and
+the tables for all of them are filled in lockstep, one amount at a time,
+so each step of the DP is a single vectorized operation over the batch.
+"""
+
+# avgs and scores (as in get_avg and get_score) for every set of denominations
+def score_batch(denom_sets: List[List[int]], N=DEFAULT_N):
+    np = _numpy()
+    B = len(denom_sets)
+    K = max(map(len, denom_sets), default=0)
+    denoms = np.ones((B, max(K, 1)), dtype=np.int64)
+    for b, ds in enumerate(denom_sets):
+        denoms[b, :len(ds)] = ds
+    if (denoms < 1).any():
+        raise ValueError("denominations must be positive")
+
+    bills_for = np.zeros((B, N + 1), dtype=np.int64)
+    rows = np.arange(B)[:, None]
+    for i in range(1, N + 1):
+        prev = i - denoms
+        too_big = prev < 0
+        candidates = bills_for[rows, np.maximum(prev, 0)]
+        # more bills than any amount up to N can need
+        candidates[too_big] = N + 1
+        bills_for[:, i] = candidates.min(axis=1) + 1
+
+    avgs = bills_for.sum(axis=1) / (N + 1)
+    has_one = np.array([1 in ds for ds in denom_sets], dtype=bool)
+    avgs[~has_one] = float('inf')
+    scores = avgs * np.array([len(ds) for ds in denom_sets], dtype=np.float64)
+    return avgs, scores
+
+"""
+Search
+
+Finds the set of k denominations (1 and k - 1 others up to max_value) with
+the lowest score, by depth-first branch and bound over increasing
+denominations:
+- a child's table is its parent's table with one more denomination
+  folded in, so siblings share all the work done for their prefix;
+- amounts up to the last denomination d can't use any denomination added
+  after it, so their bills are already final; every larger amount i needs
+  at least max(2, ceil(i / max_value)) bills, except that the r
+  denominations still to be added take a single bill. So a prefix with
+  table T can't get a total below
+      sum(T[:d+1]) + sum(max(2, ceil(i / max_value)) for i in d+1..N)
+        - min(r, number of amounts in d+1..min(max_value, N))
+  and is pruned, before its table is even computed, once that is worse
+  than the best total found so far.
+The subtrees for each choice of second denomination are spread over a
+process pool, which shares the best total found so far.
+"""
+
+# bills_for with denomination d added (bills_for must already include 1)
+def add_denom(bills_for: List[int], d: int) -> List[int]:
+    bills_for = bills_for[:]
+    for i in range(d, len(bills_for)):
+        if bills_for[i - d] + 1 < bills_for[i]:
+            bills_for[i] = bills_for[i - d] + 1
+    return bills_for
+
+# best total so far, shared between search workers
+_search_best = None
+
+def _init_search_worker(best):
+    global _search_best
+    _search_best = best
+
+# best (total, denoms) among the sets of k denominations starting with
+# [1, second], or None if they were all pruned
+def _search_subtree(task: Tuple[int, int, int, int]):
+    second, k, max_value, N = task
+    # tail[m] = sum(max(2, ceil(i / max_value)) for i in m..N)
+    tail = [0] * (N + 2)
+    for i in range(N, 0, -1):
+        tail[i] = tail[i + 1] + max(2, -(-i // max_value))
+
+    found = None
+
+    # try adding each of choices to denoms
+    def visit(denoms, bills_for, choices):
+        nonlocal found
+        # denominations still to add after this one
+        r = k - len(denoms) - 1
+        prefix = list(accumulate(bills_for))
+        for d in choices:
+            # with d itself now a single bill
+            up_to_d = prefix[d - 1] + 1 if d <= N else prefix[N]
+            room = max(0, min(max_value, N) - d)
+            if up_to_d + tail[min(d + 1, N + 1)] - min(r, room) > _search_best.value:
+                continue
+
+            child = add_denom(bills_for, d)
+            if r > 0:
+                # leave room for the denominations after the next one
+                visit(denoms + [d], child, range(d + 1, max_value - r + 2))
+                continue
+
+            total = sum(child)
+            if found is None or (total, denoms + [d]) < found:
+                found = (total, denoms + [d])
+            with _search_best.get_lock():
+                if total < _search_best.value:
+                    _search_best.value = total
+
+    visit([1], list(range(N + 1)), [second])
+    return found
+
+# lowest (total bills over 0..N, denoms) over sets of k denominations from
+# 1..max_value that contain 1, or None if no set has a total below `below`.
+# progress, if given, is called as
+# progress(subtrees done, subtrees, best score so far, its denoms)
+# as subtrees finish
+def search_total(k: int, max_value: int, N=DEFAULT_N, workers=None, progress=None,
+                 below=None):
+    if not 1 <= k <= max_value:
+        raise ValueError(f"need 1 <= k <= max_value, got k={k}, max_value={max_value}")
+    if below is None:
+        below = sum(range(N + 1)) + 1
+    if k == 1:
+        total = sum(range(N + 1))
+        return (total, [1]) if total < below else None
+
+    # imported here, since it's slow to import and only search needs it
+    import multiprocessing
+    best = multiprocessing.Value('q', below - 1)
+    tasks = [(second, k, max_value, N) for second in range(2, max_value - k + 3)]
+    found = None
+
+    def collect(results):
+        nonlocal found
+        for done, result in enumerate(results, 1):
+            if result is not None and (found is None or result < found):
+                found = result
+            if progress is not None and found is not None:
+                progress(done, len(tasks), get_score(found[0] / (N + 1), k), found[1])
+
+    if workers == 1:
+        _init_search_worker(best)
+        collect(map(_search_subtree, tasks))
+    else:
+        with multiprocessing.Pool(workers, _init_search_worker, (best,)) as pool:
+            collect(pool.imap_unordered(_search_subtree, tasks))
+
+    # leaves are only pruned by their bounds, so found may not be below
+    if found is None or found[0] >= below:
+        return None
+    return found
+
+# lowest (score, denoms), see search_total
+def search(k: int, max_value: int, N=DEFAULT_N, workers=None, progress=None):
+    total, denoms = search_total(k, max_value, N, workers, progress)
+    return get_score(total / (N + 1), k), denoms
+
+"""
+Pareto frontier
+
+Instead of combining the number of denominations and the average into
+one score, lists every tradeoff between the two that isn't dominated:
+for k = 1, 2, ... (up to max_k, if given), the best set of k
+denominations, if its average is strictly lower than the best with fewer
+denominations. Each k takes much longer than the one before, so without
+max_k, a large max_value means waiting practically forever for the end.
+Each k is a search whose bound starts at the previous best total, so
+sets that are already dominated are pruned instead of evaluated.
+"""
+
+# yields (k, avg, denoms) for each point on the frontier, in order of k,
+# as soon as it is known
+def pareto_frontier(max_value: int, N=DEFAULT_N, workers=None, max_k=None):
+    # no set does better than all of 1..max_value
+    floor = sum(-(-i // max_value) for i in range(N + 1))
+    below = None
+    last = max_value if max_k is None else min(max_k, max_value)
+    for k in range(1, last + 1):
+        found = search_total(k, max_value, N, workers, below=below)
+        if found is not None:
+            below, denoms = found
+            yield k, below / (N + 1), denoms
+        if below == floor:
+            return
+
+"""
+Batch scoring of many lines
+
+Scores one set of denominations per line of input (integers separated by
+spaces or commas, or a JSON list) on a pool of worker processes, yielding
+one result per line in input order. At most max_pending lines are in
+flight at a time, so memory doesn't grow with the size of the input.
+"""
+
+# result for one line of input, see score_lines
+def score_line(task: Tuple[str, int, str]) -> dict:
+    line, N, engine = task
+    start = time.perf_counter()
+    try:
+        if line.lstrip().startswith('['):
+            denoms = json.loads(line)
+        else:
+            denoms = [int(d) for d in line.replace(',', ' ').split()]
+    except ValueError as e:
+        return {"line": line.rstrip("\n"), "error": f"can't parse denominations: {e}"}
+    if not isinstance(denoms, list) or not all(type(d) is int and d > 0 for d in denoms):
+        return {"line": line.rstrip("\n"), "error": "denominations must be positive integers"}
+    # get_avg warns on stdout, which is where the results go
+    if 1 not in denoms:
+        return {"denoms": denoms, "error": "first denomination should be 1"}
+
+    avg = get_avg(denoms, N, engine=engine)
+    return {
+        "denoms": denoms,
+        "avg": avg,
+        "count": len(denoms),
+        "score": get_score(avg, len(denoms)),
+        "elapsed": time.perf_counter() - start,
+    }
+
+# score_line for every non-blank line, in order
+def score_lines(lines, N=DEFAULT_N, engine: str = "python", workers=None,
+                max_pending: int = 1024):
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine {engine!r}, expected one of {sorted(ENGINES)}")
+    tasks = ((line, N, engine) for line in lines if line.strip())
+    if workers == 1:
+        yield from map(score_line, tasks)
+        return
+
+    import multiprocessing
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(score_line, (task,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
 
 """
 A single test demonstrating the bug
@@ -136,15 +1053,112 @@ Don't modify this part -- it doesn't contain the bug.
 """
 
 import argparse
-if __name__ == '__main__':
+
+# python3 part3.py search -k <k> --max-value <largest denomination>
+def search_main(argv: List[str]):
+    parser = argparse.ArgumentParser(prog='part3.py search')
+    parser.add_argument(
+        '-k', type=int, required=True,
+        help='number of denominations (including 1)'
+    )
+    parser.add_argument(
+        '--max-value', type=int, default=DEFAULT_N,
+        help='largest denomination to consider'
+    )
+    parser.add_argument(
+        '-N', type=int, default=DEFAULT_N,
+        help='largest amount to average over'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='number of worker processes (default: one per CPU)'
+    )
+    args = parser.parse_args(argv)
+
+    def progress(done, total, score, denoms):
+        print(f"[{done}/{total}] best so far: {denoms} (score {round(score, 2)})",
+              file=sys.stderr)
+
+    score, denoms = search(args.k, args.max_value, args.N, args.workers, progress)
+    print(f"Best denominations: {denoms}")
+    print(f"score: {round(score, 2)}")
+
+# python3 part3.py pareto --max-value <largest denomination> [--max-k <k>]
+def pareto_main(argv: List[str]):
+    parser = argparse.ArgumentParser(prog='part3.py pareto')
+    parser.add_argument(
+        '--max-value', type=int, required=True,
+        help='largest denomination to consider'
+    )
+    parser.add_argument(
+        '--max-k', type=int, default=None,
+        help='largest number of denominations to consider (default: up to --max-value)'
+    )
+    parser.add_argument(
+        '-N', type=int, default=DEFAULT_N,
+        help='largest amount to average over'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='number of worker processes (default: one per CPU)'
+    )
+    args = parser.parse_args(argv)
+    for k, avg, denoms in pareto_frontier(args.max_value, args.N, args.workers, args.max_k):
+        print(f"number: {k}; avg: {round(avg, 2)}; denominations: {denoms}", flush=True)
+
+# python3 part3.py batch [file], one set of denominations per line
+def batch_main(argv: List[str]):
+    parser = argparse.ArgumentParser(prog='part3.py batch')
+    parser.add_argument(
+        'input', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+        help='file with one list of denominations per line (default: stdin)'
+    )
+    parser.add_argument(
+        '-N', type=int, default=DEFAULT_N,
+        help='largest amount to average over'
+    )
+    parser.add_argument(
+        '--engine', choices=sorted(ENGINES), default='python',
+        help='how to compute the average'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='number of worker processes (default: one per CPU)'
+    )
+    args = parser.parse_args(argv)
+    for result in score_lines(args.input, args.N, args.engine, args.workers):
+        print(json.dumps(result), flush=True)
+
+COMMANDS = {
+    'search': search_main,
+    'pareto': pareto_main,
+    'batch': batch_main,
+}
+
+if __name__ == '__main__' and sys.argv[1:2] and sys.argv[1] in COMMANDS:
+    COMMANDS[sys.argv[1]](sys.argv[2:])
+elif __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'integers', type=int, nargs='+',
         help='list of denominations'
     )
-    denoms = parser.parse_args().integers
+    parser.add_argument(
+        '-N', type=int, default=DEFAULT_N,
+        help='largest amount to average over'
+    )
+    parser.add_argument(
+        '--engine', choices=sorted(ENGINES), default='python',
+        help='how to compute the average (periodic handles very large N)'
+    )
+    parser.add_argument(
+        '--weights', default=None,
+        help='.npy histogram of how likely each amount from 0 to N is'
+    )
+    args = parser.parse_args()
+    denoms = args.integers
     print(f"Denominations provided: {denoms}")
-    avg = get_avg(denoms)
+    avg = get_avg(denoms, args.N, engine=args.engine, weights=args.weights)
     score = get_score(avg, len(denoms))
     print(f"avg: {round(avg, 2)}; number: {len(denoms)}")
     print(f"score: {round(score, 2)}")
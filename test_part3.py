@@ -0,0 +1,331 @@
+"""
+Tests for part3.py
+
+Everything added to part3.py beyond the exercise is tested here, leaving
+part3.py with just the test_ functions the exercise asks for.
+"""
+
+import os
+import sys
+from importlib.util import find_spec
+from itertools import combinations
+
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+
+from part3 import (
+    BillsTable, ChangeTable, LoggingSink, PrometheusFileSink, StatsSink, TableCache,
+    avg_curve, bills_table, canonical_avg, canonical_counterexample, get_avg, get_score,
+    greedy, numpy_bills_table, pareto_frontier, periodic_table, periodic_total, save_table,
+    score_batch, score_lines, search, weighted_avg,
+)
+
+# denominations always containing 1, in no particular order
+denoms_st = st.lists(st.integers(min_value=2, max_value=60), max_size=6) \
+    .flatmap(lambda ds: st.permutations([1] + ds))
+n_st = st.integers(min_value=0, max_value=500)
+
+HAS_NUMPY = find_spec("numpy") is not None
+
+@pytest.mark.skipif(not HAS_NUMPY, reason="NumPy is not installed")
+@given(denoms_st, n_st)
+def test_numpy_engine(denoms, N):
+    assert get_avg(denoms, N, engine="numpy") == get_avg(denoms, N)
+    assert numpy_bills_table(denoms, N).tolist() == bills_table(denoms, N)
+
+@pytest.mark.skipif(not HAS_NUMPY, reason="NumPy is not installed")
+@given(st.lists(st.one_of(denoms_st, st.lists(st.integers(2, 60), min_size=1, max_size=3))),
+       st.integers(min_value=0, max_value=200))
+def test_score_batch(denom_sets, N):
+    avgs, scores = score_batch(denom_sets, N)
+    for denoms, avg, score in zip(denom_sets, avgs, scores):
+        assert avg == get_avg(denoms, N)
+        assert score == get_score(avg, len(denoms))
+
+@pytest.mark.skipif(not HAS_NUMPY, reason="NumPy is not installed")
+@given(denoms_st, st.integers(min_value=0, max_value=300),
+       st.integers(min_value=1, max_value=100))
+def test_avg_curve(denoms, N_max, chunk):
+    curve = avg_curve(denoms, N_max, chunk=chunk)
+    assert curve.tolist() == [get_avg(denoms, N) for N in range(N_max + 1)]
+
+@pytest.mark.skipif(not HAS_NUMPY, reason="NumPy is not installed")
+@given(denoms_st, n_st, st.data())
+def test_weighted_avg(denoms, N, data):
+    assert get_avg(denoms, N, weights=[1] * (N + 1)) == get_avg(denoms, N)
+    i = data.draw(st.integers(min_value=0, max_value=N))
+    weights = [0] * (N + 1)
+    weights[i] = data.draw(st.integers(min_value=1, max_value=1000))
+    assert get_avg(denoms, N, weights=weights) == bills_table(denoms, N)[i]
+    assert get_avg(denoms, N, engine="numpy", weights=weights) == bills_table(denoms, N)[i]
+
+@pytest.mark.skipif(not HAS_NUMPY, reason="NumPy is not installed")
+@pytest.mark.parametrize("engine", ["rolling", "periodic", "cached", "canonical"])
+def test_weighted_avg_engines(engine):
+    with pytest.raises(ValueError):
+        get_avg([1, 3, 4], 50, engine=engine, weights=[1] * 51)
+    with pytest.raises(ValueError):
+        get_avg([1, 3, 4], 50, weights=[1] * 51, stats=StatsSink())
+
+@pytest.mark.skipif(not HAS_NUMPY, reason="NumPy is not installed")
+def test_weighted_avg_file(tmp_path):
+    import numpy as np
+    path = tmp_path / "histogram.npy"
+    # amounts ending in 0 are ten times as likely
+    np.save(path, np.array([10 if i % 10 == 0 else 1 for i in range(1001)]))
+    expected = sum(
+        b * (10 if i % 10 == 0 else 1)
+        for i, b in enumerate(bills_table([1, 5, 10, 20, 50], 1000))
+    ) / (10 * 101 + 900)
+    assert get_avg([1, 5, 10, 20, 50], 1000, weights=path) == pytest.approx(expected)
+    assert weighted_avg([1, 5, 10, 20, 50], 1000, str(path), chunk=7) \
+        == pytest.approx(expected)
+    with pytest.raises(ValueError):
+        get_avg([1, 5, 10, 20, 50], weights=path)
+
+@given(denoms_st, n_st, st.sampled_from(["python", "numpy"] if HAS_NUMPY else ["python"]))
+def test_instrumented_avg(denoms, N, engine):
+    stats = StatsSink()
+    assert get_avg(denoms, N, engine=engine, stats=stats) == get_avg(denoms, N)
+    assert get_avg(denoms, N, engine=engine, stats=stats) == get_avg(denoms, N)
+    assert (stats.calls, stats.cells) == (2, 2 * N)
+    assert stats.comparisons == 2 * counted_comparisons(denoms, N, engine)
+    table = bills_table(denoms, N)
+    if engine == "numpy":
+        assert stats.largest_table_bytes == 8 * (N + 1)
+    else:
+        assert stats.largest_table_bytes >= sys.getsizeof(table)
+
+# comparisons the engine really makes, counted by wrapping what makes them
+def counted_comparisons(denoms, N, engine):
+    count = 0
+    with pytest.MonkeyPatch.context() as patch:
+        if engine == "numpy":
+            import numpy as np
+            minimum = np.minimum
+
+            class CountingMinimum:
+                def accumulate(self, grid, **kwargs):
+                    nonlocal count
+                    count += (grid.shape[0] - 1) * grid.shape[1]
+                    return minimum.accumulate(grid, **kwargs)
+            patch.setattr(np, "minimum", CountingMinimum())
+        else:
+            import part3
+            min_next = part3.min_next
+
+            def counting_min_next(i, denoms, bills_for):
+                nonlocal count
+                count += len([d for d in denoms if i - d >= 0]) - 1
+                return min_next(i, denoms, bills_for)
+            patch.setattr(part3, "min_next", counting_min_next)
+        get_avg(denoms, N, engine=engine)
+    return count
+
+def test_instrumentation_sinks(tmp_path, caplog):
+    path = tmp_path / "part3.prom"
+    sink = PrometheusFileSink(path)
+    get_avg([1, 5, 10], stats=sink)
+    assert "part3_get_avg_cells_total 100\n" in path.read_text()
+    assert path.read_text() == sink.prometheus()
+    with caplog.at_level("INFO"):
+        get_avg([1, 5, 10], stats=LoggingSink())
+    assert "cells=100" in caplog.text
+    with pytest.raises(ValueError):
+        get_avg([1, 5, 10], engine="rolling", stats=sink)
+
+@pytest.mark.skipif(not HAS_NUMPY, reason="NumPy is not installed")
+def test_avg_curve_file(tmp_path):
+    import numpy as np
+    path = tmp_path / "curve.npy"
+    curve = avg_curve([1, 5, 10, 20, 50], 1000, path=path, chunk=64)
+    saved = np.load(path, mmap_mode='r')
+    assert saved.tolist() == curve.tolist() == avg_curve([1, 5, 10, 20, 50], 1000).tolist()
+    assert saved[100] == get_avg([1, 5, 10, 20, 50])
+
+@given(denoms_st, st.lists(n_st, min_size=1, max_size=5))
+def test_table_cache(denoms, Ns):
+    cache = TableCache(max_bytes=4096)
+    for N in Ns:
+        assert cache.total(denoms, N) / (N + 1) == get_avg(denoms, N)
+        assert cache.nbytes == sum(map(cache.entry_bytes, cache.entries.values()))
+        assert cache.nbytes <= cache.max_bytes
+    assert cache.hits + cache.misses + cache.extensions == len(Ns)
+
+@given(denoms_st, n_st, st.sampled_from(["python", "numpy"] if HAS_NUMPY else ["python"]),
+       st.data())
+def test_bills_table_file(denoms, N, engine, data):
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "table.bin")
+        save_table(path, denoms, N, engine=engine)
+        with BillsTable(path) as table:
+            bills_for = bills_table(denoms, N)
+            assert table.denoms == sorted(set(denoms))
+            assert list(table.bills_for) == bills_for
+            assert table.avg() == get_avg(denoms, N)
+            lo = data.draw(st.integers(min_value=0, max_value=N))
+            hi = data.draw(st.integers(min_value=lo, max_value=N))
+            assert table.avg(lo, hi) == sum(bills_for[lo:hi + 1]) / (hi - lo + 1)
+
+def test_bills_table_file_invalid(tmp_path):
+    path = tmp_path / "table.bin"
+    path.write_bytes(b"name,age\n")
+    with pytest.raises(ValueError):
+        BillsTable(path)
+
+@pytest.mark.parametrize("size", [0, 40, -1, -500])
+def test_bills_table_file_truncated(tmp_path, size):
+    path = tmp_path / "table.bin"
+    save_table(path, [1, 5, 10], 1000)
+    data = path.read_bytes()
+    path.write_bytes(data[:size])
+    with pytest.raises(ValueError):
+        BillsTable(path)
+    path.write_bytes(data + b"\0")
+    with pytest.raises(ValueError):
+        BillsTable(path)
+
+def test_bills_table_file_itemsize(tmp_path):
+    path = tmp_path / "table.bin"
+    save_table(path, [1, 5, 10], 10)
+    data = bytearray(path.read_bytes())
+    # bytes per entry, just after the magic and version
+    data[10] = 3
+    path.write_bytes(data)
+    with pytest.raises(ValueError, match="corrupt header"):
+        BillsTable(path)
+
+@given(denoms_st, st.integers(min_value=0, max_value=3000))
+def test_periodic_engine(denoms, N):
+    assert get_avg(denoms, N, engine="periodic") == get_avg(denoms, N)
+
+def test_no_test_imports():
+    import subprocess
+    code = """if True:
+        import sys, part1, part2, part3
+        assert not {'pytest', 'hypothesis'} & set(sys.modules)
+
+        # decorated functions that aren't tests stay functions too
+        from testdeps import pytest, given, settings, st
+        @st.composite
+        def strategy(draw):
+            return 1
+        @pytest.fixture
+        def fixture():
+            return 2
+        @settings(max_examples=5)
+        @given(st.integers())
+        def check(x):
+            return 3
+        assert (strategy(None), fixture(), check(0)) == (1, 2, 3)
+    """
+    subprocess.run([sys.executable, "-c", code], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_score_lines(workers):
+    lines = ["1 5 10 20 50\n", "\n", "[1, 3, 4]\n", "2,3\n", "1 x\n", "[1, 0]\n"] + \
+        [f"1 {d}\n" for d in range(2, 30)]
+    results = list(score_lines(iter(lines), workers=workers, max_pending=4))
+    assert len(results) == len(lines) - 1
+    assert results[0]["avg"] == get_avg([1, 5, 10, 20, 50])
+    assert results[1]["score"] == get_score(get_avg([1, 3, 4]), 3)
+    assert all("error" in r for r in results[2:5])
+    assert [r["denoms"] for r in results[5:]] == [[1, d] for d in range(2, 30)]
+    assert all(r["count"] == 2 and r["elapsed"] >= 0 for r in results[5:])
+
+@given(denoms_st, n_st)
+def test_change_table(denoms, N):
+    change = ChangeTable(denoms, N)
+    assert change.avg() == get_avg(denoms, N)
+    for amount, best in enumerate(bills_table(denoms, N)):
+        bills = change.bills(amount)
+        assert sum(bills) == amount
+        assert len(bills) == best
+        assert set(bills) <= set(denoms)
+
+@given(denoms_st)
+def test_canonical_counterexample(denoms):
+    coins = sorted(set(denoms), reverse=True)
+    # any counterexample is below the sum of the two largest denominations
+    bills_for = bills_table(coins, sum(coins[:2]))
+    expected = next(
+        (x for x, b in enumerate(bills_for) if sum(greedy(x, coins)) > b),
+        None
+    )
+    assert canonical_counterexample(denoms) == expected
+
+@given(denoms_st, n_st)
+def test_canonical_engine(denoms, N):
+    avg, path = canonical_avg(denoms, N)
+    assert avg == get_avg(denoms, N)
+    assert (path == "greedy") == (canonical_counterexample(denoms) is None)
+
+def test_canonical_examples():
+    assert canonical_counterexample([1, 5, 10, 20, 50, 100]) is None
+    assert canonical_counterexample([1, 3, 4]) == 6
+    assert canonical_avg([1, 5, 10, 20, 50, 100], 10**12)[1] == "greedy"
+    # non-canonical, and still cheap for large N
+    assert canonical_avg([1, 3, 4], 10**12) \
+        == (periodic_total([1, 3, 4], 10**12) / (10**12 + 1), "dp")
+
+@given(denoms_st, n_st)
+def test_rolling_engine(denoms, N):
+    assert get_avg(denoms, N, engine="rolling") == get_avg(denoms, N)
+
+def test_periodic_engine_large_N():
+    bills_for, s = periodic_table([1, 5, 10, 20, 50, 100])
+    assert (len(bills_for), s) == (200, 100)
+    # every 100 above the first costs exactly one more bill
+    N = 10**12
+    assert periodic_total([1, 5, 10, 20, 50, 100], N) \
+        == periodic_total([1, 5, 10, 20, 50], 99) * (N // 100) \
+        + 100 * (N // 100) * (N // 100 - 1) // 2 + N // 100
+
+def test_table_cache_eviction():
+    cache = TableCache(max_bytes=3 * 2 * 8 * 101)
+    for d in range(2, 6):
+        cache.total([1, d], 100)
+    assert list(cache.entries) == [(1, 3), (1, 4), (1, 5)]
+    assert cache.evictions == 1
+    cache.total([3, 1], 50)
+    cache.total([1, 6], 100)
+    assert list(cache.entries) == [(1, 5), (1, 3), (1, 6)]
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 5, 2)
+
+@given(st.integers(min_value=1, max_value=4), st.integers(min_value=4, max_value=12),
+       st.integers(min_value=0, max_value=60))
+def test_search(k, max_value, N):
+    score, denoms = search(k, max_value, N, workers=1)
+    expected = min(
+        (get_score(get_avg([1, *ds], N), k), [1, *ds])
+        for ds in combinations(range(2, max_value + 1), k - 1)
+    )
+    assert (score, denoms) == expected
+
+def test_search_parallel():
+    progress = []
+    result = search(4, 30, workers=2, progress=lambda *args: progress.append(args))
+    assert result == search(4, 30, workers=1)
+    assert progress[-1] == (27, 27, *result)
+
+@given(st.integers(min_value=1, max_value=9), st.integers(min_value=0, max_value=40),
+       st.integers(min_value=1, max_value=9))
+def test_pareto_frontier(max_value, N, max_k):
+    best = [
+        min(
+            (get_avg([1, *ds], N), [1, *ds])
+            for ds in combinations(range(2, max_value + 1), k - 1)
+        )
+        for k in range(1, max_value + 1)
+    ]
+    expected = [
+        (k, avg, denoms)
+        for k, (avg, denoms) in enumerate(best, 1)
+        if all(avg < prev for prev, _ in best[:k - 1])
+    ]
+    assert list(pareto_frontier(max_value, N, workers=1)) == expected
+    assert list(pareto_frontier(max_value, N, workers=1, max_k=max_k)) == \
+        [point for point in expected if point[0] <= max_k]
@@ -0,0 +1,38 @@
+"""
+Test-only imports
+
+part1.py, part2.py and part3.py keep their tests next to the code they
+test, but loading pytest and Hypothesis takes a few hundred milliseconds,
+which anyone importing get_avg or to_csv as a library (or running the
+part3.py command line) shouldn't have to pay for.
+
+So the parts import them from here instead:
+
+    from testdeps import pytest, given, assume, settings, st
+
+Under pytest (which is always imported before it collects a file) these
+are the real thing. Anywhere else the tests never run, so they are
+placeholders that leave any function they decorate as it is, and
+strategies built from them (like part2's t, z and lt) are placeholders too.
+"""
+
+import sys
+
+if "pytest" in sys.modules:
+    import pytest
+    from hypothesis import assume, given, settings
+    from hypothesis import strategies as st
+else:
+    class _NotTesting:
+        # pytest.mark.xfail(...), st.integers(...), given(...), etc.
+        def __getattr__(self, name):
+            return self
+
+        # ... and, applied to a function (a test, @st.composite strategy,
+        # fixture, ...) as a decorator, the function itself
+        def __call__(self, *args, **kwargs):
+            if len(args) == 1 and not kwargs and callable(args[0]):
+                return args[0]
+            return self
+
+    pytest = given = assume = settings = st = _NotTesting()